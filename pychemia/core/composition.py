@@ -5,14 +5,36 @@ the species present on a cell.
 """
 
 import re
-from numpy import array, argsort
+import sys
+from types import MappingProxyType
 from math import gcd as _gcd
 from math import pi
 from pychemia.utils.periodic import atomic_symbols, electronegativity, atomic_number, covalent_radius
-from pychemia.utils.computing import deep_unicode
 from functools import reduce
+from itertools import chain
+from collections import Counter
 from collections.abc import Mapping
 
+# Since Python 3.9 'math.gcd' accepts an arbitrary number of arguments and the
+# whole reduction runs in C, much faster than 'functools.reduce' over pairs.
+_GCD_VARARGS = sys.version_info >= (3, 9)
+
+# Tokenizer for chemical formulas: an atomic symbol (uppercase plus up to two
+# lowercase letters) followed by an optional number of atoms.
+_FORMULA_RE = re.compile(r'([A-Z][a-z]{0,2})(\d*)')
+
+# Symbol -> property tables built once at import time, giving constant-time
+# lookups instead of scanning the periodic table lists on every call.
+_ELECTRONEGATIVITY = {symbol: electronegativity(symbol) for symbol in atomic_symbols if symbol}
+_ATOMIC_NUMBER = {symbol: atomic_number(symbol) for symbol in atomic_symbols if symbol}
+_COVALENT_RADIUS_CUBED = {symbol: covalent_radius(symbol) ** 3 for symbol in atomic_symbols if symbol}
+
+# Constant-time membership test for symbol validation, 'atomic_symbols' is a list
+_ATOMIC_SYMBOLS_SET = frozenset(atomic_symbols)
+
+# Shared instances returned by Composition.intern, keyed by the formula string
+_INTERN = {}
+
 
 class Composition(Mapping):
     """
@@ -21,9 +43,15 @@ class Composition(Mapping):
     A composition object do not contain geometrical information or bonding.
 
     The main purpose of this class is to be able to parse formulas into compositions and return string formulas sorted
-    in various ways.
+    in various ways. Compositions are immutable and hashable, so they can be used as dictionary keys and shared
+    between callers.
     """
 
+    # A composition is effectively immutable once built, so derived quantities are
+    # memoized per instance and only invalidated when the dictionary is replaced.
+    __slots__ = ('_composition', '_gcd', '_natom', '_nspecies', '_species', '_values',
+                 '_species_hex', '_formula_cache')
+
     def __init__(self, value=None):
         """
         Creates a new composition,  currently only absolute formulas are supported.
@@ -50,11 +78,9 @@ class Composition(Mapping):
         2
 
         """
-        # The internal dictionary where atom species and numbers of atoms of each specie are stored.
-        self._composition = {}
-        # Convert strings and dictionaries into unicode
-        if value is not None:
-            value = deep_unicode(value)
+        # The internal read-only mapping where atom species and numbers of atoms of each specie are stored.
+        self._composition = MappingProxyType({})
+        self._reset_cache()
         # Case 1: The input is a formula
         if isinstance(value, str):
             self._set_composition(self.formula_parser(value))
@@ -66,15 +92,8 @@ class Composition(Mapping):
             self._set_composition(value.composition)
         # Case 4: The input is an iterable of atomic symbols
         elif hasattr(value, "__len__"):
-            dvalue = {}
-            for i in value:
-                if i in dvalue:
-                    dvalue[i] += 1
-                else:
-                    dvalue[i] = 1
-            self._set_composition(dvalue)
-        else:
-            self._composition = {}
+            self._set_composition(dict(Counter(value)))
+        # Any other input leaves the empty read-only mapping set above
 
     def __len__(self):
         return len(self._composition)
@@ -121,10 +140,7 @@ class Composition(Mapping):
         >>> 'Cu' in str(cp)
         True
         """
-        ret = ''
-        for i in self.species:
-            ret += " %3s: %4d  " % (i, self.composition[i])
-        return ret
+        return ''.join(" %3s: %4d  " % (specie, number) for specie, number in self._composition.items())
 
     def __iter__(self):
         return iter(self.composition)
@@ -142,6 +158,49 @@ class Composition(Mapping):
         """
         return specie in self._composition
 
+    def __eq__(self, other):
+        """True if both compositions have the same species and numbers of atoms
+
+        :param other: Composition or mapping to compare with
+        :rtype: bool
+
+        >>> Composition('H2O') == Composition({'O': 1, 'H': 2})
+        True
+        >>> Composition('H2O') == Composition('H2O2')
+        False
+        """
+        if isinstance(other, Composition):
+            return self._composition == other._composition
+        if isinstance(other, Mapping):
+            return dict(self._composition) == dict(other)
+        return NotImplemented
+
+    def __hash__(self):
+        """Hash based on the reduced formula, making compositions usable as dictionary keys
+
+        :return: Hash of the normalized formula
+        :rtype: int
+
+        >>> cp1 = Composition('H2O')
+        >>> cp2 = Composition({'H': 2, 'O': 1})
+        >>> hash(cp1) == hash(cp2)
+        True
+        """
+        return hash(self.formula)
+
+    def __reduce__(self):
+        """Support for pickle and copy, rebuilding the composition from a plain dictionary
+
+        :return: Tuple with the class and the arguments to reconstruct the object
+        :rtype: tuple
+
+        >>> import pickle
+        >>> cp = Composition('H2O')
+        >>> pickle.loads(pickle.dumps(cp)) == cp
+        True
+        """
+        return self.__class__, (dict(self._composition),)
+
     def _set_composition(self, value):
         """
         Checks the values of a dictionary before setting the actual composition
@@ -149,10 +208,30 @@ class Composition(Mapping):
         :param value: (dict)
         :rtype: None
         """
-        for i in value:
-            assert (i in atomic_symbols)
-            assert (isinstance(value[i], int))
-        self._composition = value.copy()
+        for specie, number in value.items():
+            if specie not in _ATOMIC_SYMBOLS_SET:
+                raise ValueError('Non-valid atomic symbol: "%s"' % specie)
+            if not isinstance(number, int):
+                raise ValueError('Number of atoms for "%s" must be an integer, not: %s' % (specie, number))
+        # The proxy makes the composition effectively immutable, which is what
+        # makes the memoization and the interning of instances safe.
+        self._composition = MappingProxyType(dict(value))
+        self._reset_cache()
+
+    def _reset_cache(self):
+        """
+        Invalidates all the memoized values derived from the composition dictionary.
+        The atom and specie counters are cheap, so they are recomputed right away.
+
+        :rtype: None
+        """
+        self._gcd = None
+        self._species_hex = None
+        self._formula_cache = {}
+        self._natom = sum(self._composition.values())
+        self._nspecies = len(self._composition)
+        self._species = tuple(self._composition)
+        self._values = tuple(self._composition.values())
 
     @property
     def composition(self):
@@ -167,7 +246,7 @@ class Composition(Mapping):
         {'H': 2, 'O': 1}
 
         """
-        return self._composition
+        return dict(self._composition)
 
     def covalent_volume(self, packing='cubes'):
         """
@@ -189,13 +268,9 @@ class Composition(Mapping):
         else:
             raise ValueError('Non-valid packing: "%s"' % packing)
 
-        # find volume of unit cell by adding cubes
-        volume = 0.0
-        for specie in self:
-            number_atoms_specie = self.composition[specie]
-            # Pack each atom in a cube (2*r)^3
-            volume += factor * number_atoms_specie * covalent_radius(specie) ** 3
-        return volume
+        # find volume of unit cell by adding cubes, packing each atom in a cube (2*r)^3
+        return sum(factor * number * _COVALENT_RADIUS_CUBED[specie]
+                   for specie, number in self._composition.items())
 
     @property
     def formula(self):
@@ -209,7 +284,19 @@ class Composition(Mapping):
         'ClNa'
 
         """
-        return self.sorted_formula(sortby='alpha', reduced=True)
+        # Specialized version of sorted_formula(sortby='alpha', reduced=True), the
+        # most common string output, sharing its cache slot with sorted_formula.
+        cached = self._formula_cache.get(('alpha', True))
+        if cached is not None:
+            return cached
+        gcd = self.gcd or 1
+        parts = []
+        for specie, number in sorted(self._composition.items()):
+            number //= gcd
+            parts.append(f'{specie}{number}' if number > 1 else specie)
+        ret = ''.join(parts)
+        self._formula_cache[('alpha', True)] = ret
+        return ret
 
     @staticmethod
     def formula_parser(value):
@@ -226,35 +313,34 @@ class Composition(Mapping):
         >>> ret = Composition.formula_parser('UutUupUusUuo')
         >>> pprint.pprint(ret)
         {'Uuo': 1, 'Uup': 1, 'Uus': 1, 'Uut': 1}
+        >>> Composition.formula_parser('H2OH')
+        {'H': 3, 'O': 1}
         """
         ret = {}
-        jump = False
-        for i in range(len(value)):
-            if jump > 0:  # This char belongs to the current atom, move on
-                jump -= 1
-            elif value[i].isupper():  # Atom Name starts with Uppercase
-                if i + 1 < len(value) and value[i + 1].islower():  # Atom name has more than 1 char
-                    if i + 2 < len(value) and value[i + 2].islower():  # Atom name has more than 2 chars
-                        specie = value[i:i + 3]
-                        jump = 2
-                    else:
-                        specie = value[i:i + 2]
-                        jump = 1
-                else:
-                    specie = value[i]
-                    jump = 0
-                j = 1
-                number = ''
-                while True:
-                    if i + jump + j < len(value) and value[i + jump + j].isdigit():
-                        number += value[i + jump + j]
-                        j += 1
-                    else:
-                        break
-                if number == '':
-                    ret[specie] = 1
-                else:
-                    ret[specie] = int(number)
+        for specie, number in _FORMULA_RE.findall(value):
+            ret[specie] = ret.get(specie, 0) + (int(number) if number else 1)
+        return ret
+
+    @staticmethod
+    def formula_parser_batch(values):
+        """Parse several chemical formulas in a single call
+
+        :return: Convert an iterable of chemical formulas into a list of dictionaries, one per formula, with the
+                 species as keys and the number of atoms of each specie as values. Intended for ingestion workflows
+                 parsing many formulas, where the per-call overhead of formula_parser adds up.
+        :param values: Iterable of chemical formulas
+        :rtype: list
+
+        >>> Composition.formula_parser_batch(['Au20', 'H2O'])
+        [{'Au': 20}, {'H': 2, 'O': 1}]
+        """
+        findall = _FORMULA_RE.findall
+        ret = []
+        for value in values:
+            composition = {}
+            for specie, number in findall(value):
+                composition[specie] = composition.get(specie, 0) + (int(number) if number else 1)
+            ret.append(composition)
         return ret
 
     @staticmethod
@@ -292,6 +378,26 @@ class Composition(Mapping):
 
         return composition
 
+    @classmethod
+    def intern(cls, value):
+        """Shared Composition instance for a given formula
+
+        :return: A cached Composition built from the formula, creating it on first use. Since compositions are
+                 immutable the instance can be shared, deduplicating workflows that see the same formula many times.
+        :param value: (str) Chemical formula
+        :rtype: Composition
+
+        >>> cp1 = Composition.intern('H2O')
+        >>> cp2 = Composition.intern('H2O')
+        >>> cp1 is cp2
+        True
+        """
+        ret = _INTERN.get(value)
+        if ret is None:
+            ret = cls(value)
+            _INTERN[value] = ret
+        return ret
+
     @property
     def gcd(self):
         """ Number of minimal formulas on a given composition.
@@ -310,10 +416,12 @@ class Composition(Mapping):
         >>> cp.gcd is None
         True
         """
-        if self.natom > 0:
-            return reduce(_gcd, self.values)
-        else:
-            return None
+        if self._gcd is None and self.natom > 0:
+            if _GCD_VARARGS:
+                self._gcd = _gcd(*self._composition.values())
+            else:
+                self._gcd = reduce(_gcd, self._composition.values())
+        return self._gcd
 
     @staticmethod
     def get_species_from_hex(arg):
@@ -326,11 +434,8 @@ class Composition(Mapping):
         [8, 29, 39, 56]
         """
         num = int(arg, 16)
-        ret = []
-        while num > 0:
-            ret.append(num % 256)
-            num = (num-ret[-1])//256
-        return ret
+        nbytes = (num.bit_length() + 7) // 8
+        return list(num.to_bytes(nbytes, 'little'))
 
     @property
     def natom(self):
@@ -342,7 +447,7 @@ class Composition(Mapping):
         >>> cp.natom
         3
         """
-        return sum(self.values)
+        return self._natom
 
     @property
     def nspecies(self):
@@ -354,7 +459,7 @@ class Composition(Mapping):
         >>> cp.nspecies
         2
         """
-        return len(self.species)
+        return self._nspecies
 
     @property
     def symbols(self):
@@ -367,12 +472,10 @@ class Composition(Mapping):
         >>> cp.symbols
         ['H', 'H', 'O']
         """
-        ret = []
-        for specie in self:
-            number_atoms_specie = self.composition[specie]
-            for i in range(number_atoms_specie):
-                ret.append(specie)
-        return sorted(deep_unicode(ret))
+        # Sorting the species first gives the same result as sorting the expanded
+        # list, and the expansion itself runs in C.
+        pairs = sorted(self._composition.items())
+        return list(chain.from_iterable([specie] * number for specie, number in pairs))
 
     @property
     def species(self):
@@ -385,7 +488,7 @@ class Composition(Mapping):
         >>> sorted(cp.species)
         ['H', 'O']
         """
-        return [deep_unicode(x) for x in self._composition]
+        return list(self._species)
 
     def sorted_formula(self, sortby='alpha', reduced=True):
         """
@@ -430,37 +533,34 @@ class Composition(Mapping):
         >>> cp.sorted_formula(sortby='hill', reduced=False)
         'H2O4S'
         """
-        if reduced and self.gcd > 1:
-            comp = Composition(self.composition)
-            for i in comp.composition:
-                comp._composition[i] //= self.gcd
+        cached = self._formula_cache.get((sortby, reduced))
+        if cached is not None:
+            return cached
+        gcd = self.gcd
+        if reduced and gcd is not None and gcd > 1:
+            comp_dict = {specie: number // gcd for specie, number in self._composition.items()}
         else:
-            comp = self
+            comp_dict = self._composition
+        species = list(comp_dict)
         if sortby.lower()[:3] == 'ele':
-            electroneg = list(electronegativity(comp.species))
-            # Not longer needed as electronegativy will return 0 for 'None' values
-            # for i in range(len(electroneg)):
-            #    if electroneg[i] is None:
-            #        electroneg[i] = -1
-            sortedspecies = array(comp.species)[argsort(electroneg)]
+            electroneg = [-1 if _ELECTRONEGATIVITY[x] is None else _ELECTRONEGATIVITY[x] for x in species]
+            sortedspecies = [specie for _, specie in sorted(zip(electroneg, species))]
         elif sortby.lower()[:3] == "hil":  # FIXME: Hill system exceptions not implemented
             sortedspecies = []
-            presortedspecies = sorted(comp.species)
-            if 'C' in presortedspecies:
+            if 'C' in comp_dict:
                 sortedspecies.append('C')
-                presortedspecies.pop(presortedspecies.index('C'))
-            if 'H' in presortedspecies:
+            if 'H' in comp_dict:
                 sortedspecies.append('H')
-                presortedspecies.pop(presortedspecies.index('H'))
-            sortedspecies += presortedspecies
+            sortedspecies += sorted(x for x in species if x not in ('C', 'H'))
         else:
-            sortedspecies = sorted(comp.species)
-        ret = u''
+            sortedspecies = sorted(species)
+        parts = []
         for specie in sortedspecies:
-            ret += '%s' % specie
-            if comp.composition[specie] > 1:
-                ret += "%d" % comp.composition[specie]
-        return deep_unicode(ret)
+            number = comp_dict[specie]
+            parts.append('%s%d' % (specie, number) if number > 1 else specie)
+        ret = ''.join(parts)
+        self._formula_cache[(sortby, reduced)] = ret
+        return ret
 
     def species_encoded(self, base):
         """Encode the list of species with a number
@@ -473,11 +573,13 @@ class Composition(Mapping):
         >>> cp.species_encoded(100)
         801
         """
+        numbers = sorted(_ATOMIC_NUMBER[x] for x in self.species)
+        if base == 256:
+            # Encoding on base 256 is little-endian byte packing, a single C call
+            return int.from_bytes(bytes(numbers), 'little')
         ret = 0
-        i = 0
-        for atom_number in sorted(atomic_number(self.species)):
+        for i, atom_number in enumerate(numbers):
             ret += atom_number * (base ** i)
-            i += 1
         return ret
 
     def species_hex(self):
@@ -493,8 +595,9 @@ class Composition(Mapping):
         >>> cp.species_hex()
         '0x38271d08'
         """
-        enc = self.species_encoded(256)
-        return hex(enc)
+        if self._species_hex is None:
+            self._species_hex = hex(self.species_encoded(256))
+        return self._species_hex
 
     @property
     def values(self):
@@ -506,6 +609,6 @@ class Composition(Mapping):
         >>> sorted(cp.values)
         [1, 2, 3, 7]
         """
-        return [self._composition[x] for x in self._composition]
+        return list(self._values)
 
 